@@ -0,0 +1,66 @@
+import os
+import json
+import argparse
+import pickle
+import numpy as np
+from tqdm import tqdm
+
+# Configs
+EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", "embeds/s3_faces")
+SHARD_NAME = "embeds.f32"
+META_NAME = "meta.json"
+
+# One-shot converter: fold the per-face .pkl files into a single
+# memory-mapped (N, 512) float32 shard plus a JSON metadata sidecar.
+# Loading then costs one sequential read instead of N pickle opens.
+def build_shard(embeddings_dir):
+    face_files = sorted(f for f in os.listdir(embeddings_dir) if f.endswith('.pkl'))
+    if not face_files:
+        print(f"❌ No .pkl embeddings found in '{embeddings_dir}'")
+        return
+
+    print(f"🔍 Packing {len(face_files)} face embedding(s) from '{embeddings_dir}'")
+
+    shard_path = os.path.join(embeddings_dir, SHARD_NAME)
+    meta_path = os.path.join(embeddings_dir, META_NAME)
+
+    shard = np.memmap(shard_path, mode='w+', dtype=np.float32, shape=(len(face_files), 512))
+    meta = []
+
+    row = 0
+    for face_file in tqdm(face_files, desc="Packing embeddings"):
+        try:
+            with open(os.path.join(embeddings_dir, face_file), 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ Error loading {face_file}: {e}")
+            continue
+
+        shard[row] = np.asarray(data['embedding'], dtype=np.float32)
+        meta.append({
+            'face_id': os.path.splitext(face_file)[0],
+            'source_image': data['source_image'],
+            'region': data['region']
+        })
+        row += 1
+
+    shard.flush()
+    del shard
+    if row < len(face_files):
+        # Truncate the shard to the rows actually written
+        with open(shard_path, 'r+b') as f:
+            f.truncate(row * 512 * 4)
+
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+    print(f"✅ Wrote {row} embedding(s) to '{shard_path}' + '{meta_path}'")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embeddings-dir", default=EMBEDDINGS_DIR, help="Directory with per-face .pkl embeddings")
+    args = parser.parse_args()
+    build_shard(args.embeddings_dir)
+
+if __name__ == "__main__":
+    main()
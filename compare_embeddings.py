@@ -0,0 +1,399 @@
+import os
+import argparse
+import functools
+import json
+import pickle
+import sqlite3
+import numpy as np
+import pandas as pd
+import cv2
+import matplotlib
+matplotlib.use('Agg')  # headless backend; never try to init Tk/Qt
+import matplotlib.pyplot as plt
+from tqdm import tqdm
+
+plt.rcParams['figure.dpi'] = 100
+from concurrent.futures import ProcessPoolExecutor
+from joblib import Parallel, delayed
+from scipy.linalg.blas import sgemm
+
+# SimSIMD dispatches to AVX-512/NEON kernels for the all-pairs cosine;
+# fall back to the plain BLAS matmul when it is not installed.
+try:
+    import simsimd as simd
+    HAS_SIMSIMD = True
+except ImportError:
+    HAS_SIMSIMD = False
+
+# FAISS turns the all-pairs brute force into an approximate neighbor
+# search — optional, used for large galleries.
+try:
+    import faiss
+    HAS_FAISS = True
+except ImportError:
+    HAS_FAISS = False
+
+# Configs
+EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", "embeds/s3_faces")
+IMAGE_DIR = os.getenv("IMAGE_DIR", "test_images")
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "comparison_results")
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.7"))
+
+# Load one per-face pickle; module-level so worker processes can import it
+def _load_one(path):
+    face_id = os.path.splitext(os.path.basename(path))[0]
+    try:
+        with open(path, 'rb') as f:
+            return face_id, pickle.load(f)
+    except Exception as e:
+        print(f"⚠️ Error loading {os.path.basename(path)}: {e}")
+        return face_id, None
+
+# Load per-face embeddings saved by the embedding scripts
+def load_face_embeddings(embeddings_dir):
+    # Fast path: a packed shard (see build_shard.py) replaces N pickle
+    # opens with one sequential memory-mapped read; each face's
+    # embedding is a zero-copy view into the shard.
+    shard_path = os.path.join(embeddings_dir, "embeds.f32")
+    meta_path = os.path.join(embeddings_dir, "meta.json")
+    db_path = os.path.join(embeddings_dir, "faces.db")
+    if os.path.exists(shard_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        shard = np.memmap(shard_path, dtype=np.float32, mode='r').reshape(-1, 512)
+        print(f"🔍 Loaded {len(meta)} face embedding(s) from shard '{shard_path}'")
+        return {
+            m['face_id']: {
+                'embedding': shard[i],
+                'source_image': m['source_image'],
+                'region': m['region']
+            } for i, m in enumerate(meta)
+        }
+
+    # Shard with a SQLite index, as written by the embedding generators
+    if os.path.exists(shard_path) and os.path.exists(db_path):
+        shard = np.memmap(shard_path, dtype=np.float32, mode='r').reshape(-1, 512)
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute("SELECT face_id, row, source_image, x, y, w, h FROM faces").fetchall()
+        conn.close()
+        print(f"🔍 Loaded {len(rows)} face embedding(s) from shard '{shard_path}'")
+        return {
+            face_id: {
+                'embedding': shard[row],
+                'source_image': source_image,
+                'region': {'x': x, 'y': y, 'w': w, 'h': h}
+            } for face_id, row, source_image, x, y, w, h in rows
+        }
+
+    face_files = [f for f in os.listdir(embeddings_dir) if f.endswith('.pkl')]
+    print(f"🔍 Found {len(face_files)} face embedding(s) in '{embeddings_dir}'")
+
+    # Unpickling is CPU-bound and embarrassingly parallel; fan the files
+    # out over worker processes instead of loading serially.
+    paths = [os.path.join(embeddings_dir, f) for f in face_files]
+    with ProcessPoolExecutor() as executor:
+        results = list(tqdm(executor.map(_load_one, paths), total=len(paths), desc="Loading embeddings"))
+
+    return {face_id: data for face_id, data in results if data is not None}
+
+# Cosine similarity for a single pair of unit-norm vectors: with the
+# norms already folded in, the denominator collapses and one dot product
+# is the whole computation — no sklearn wrapping or batch normalization.
+def cos_sim_unit(a, b):
+    return float(np.dot(a, b))
+
+# Struct-of-arrays view of the loaded faces: the N^2 filter passes index
+# compact integer/rectangular arrays instead of chasing dict-of-dict
+# lookups per pair.
+def build_face_arrays(face_data):
+    face_ids = list(face_data.keys())
+    records = [face_data[fid] for fid in face_ids]
+    src_names = np.array([d['source_image'] for d in records])
+    src_ids, _ = pd.factorize(src_names)
+    regions = np.array(
+        [[d['region']['x'], d['region']['y'], d['region']['w'], d['region']['h']] for d in records],
+        dtype=np.int32
+    )
+    return face_ids, src_names, src_ids, regions
+
+# Build the result dict for one surviving pair from the SoA arrays
+def _pair_record(i, j, score, face_ids, src_names, regions):
+    return {
+        'face1_id': face_ids[i],
+        'face2_id': face_ids[j],
+        'face1_source': str(src_names[i]),
+        'face2_source': str(src_names[j]),
+        'face1_region': {'x': int(regions[i, 0]), 'y': int(regions[i, 1]), 'w': int(regions[i, 2]), 'h': int(regions[i, 3])},
+        'face2_region': {'x': int(regions[j, 0]), 'y': int(regions[j, 1]), 'w': int(regions[j, 2]), 'h': int(regions[j, 3])},
+        'similarity': float(score)
+    }
+
+# Compute the all-pairs cosine similarity matrix
+def compute_similarity_matrix(face_data, face_ids, use_int8=False):
+    # A silent float64 upcast from stored pickles would double the GEMM
+    # cost, so force float32 once here rather than per row.
+    embeddings = np.stack([face_data[fid]['embedding'] for fid in face_ids]).astype(np.float32, copy=False)
+
+    # InsightFace's normed_embedding is already unit-length, so a plain
+    # matmul gives cosine similarity directly. Only normalize when the
+    # stored embeddings turn out not to be unit-norm.
+    if not np.allclose(np.linalg.norm(embeddings[0]), 1.0):
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    assert embeddings.flags['C_CONTIGUOUS'] and embeddings.dtype == np.float32
+
+    if use_int8 and HAS_SIMSIMD:
+        # Quantize per-embedding to int8: 4x less bandwidth on the N^2
+        # sweep and SimSIMD's cosine kernel dispatches to VNNI int8 dot
+        # products. Quantization error on unit-norm embeddings is well
+        # below the similarity threshold used here.
+        scales = 127.0 / np.abs(embeddings).max(axis=1, keepdims=True)
+        emb_i8 = np.ascontiguousarray(np.round(embeddings * scales), dtype=np.int8)
+        similarity_matrix = 1.0 - np.asarray(simd.cdist(emb_i8, emb_i8, metric='cosine'))
+    elif use_int8:
+        print("⚠️ --int8 requested but simsimd is not installed; using fp32 path.")
+        similarity_matrix = sgemm(1.0, embeddings, embeddings, trans_b=True)
+    elif HAS_SIMSIMD:
+        similarity_matrix = 1.0 - np.asarray(simd.cdist(embeddings, embeddings, metric='cosine'))
+    else:
+        # sgemm pins the single-precision BLAS kernel — no chance of a
+        # dgemm dispatch from an upcast on the way in
+        similarity_matrix = sgemm(1.0, embeddings, embeddings, trans_b=True)
+
+    return similarity_matrix
+
+# Find all cross-image face pairs above the similarity threshold
+def find_similar_faces(face_ids, src_names, src_ids, regions, similarity_matrix, threshold=SIMILARITY_THRESHOLD):
+    n = len(face_ids)
+
+    # Vectorized extraction over the upper triangle: the "same source"
+    # filter is a single integer-array comparison instead of N^2/2 dict
+    # lookups in Python.
+    iu = np.triu_indices(n, k=1)
+    same_src = src_ids[iu[0]] == src_ids[iu[1]]
+    mask = (similarity_matrix[iu] >= threshold) & ~same_src
+
+    ii, jj = iu[0][mask], iu[1][mask]
+    scores = similarity_matrix[ii, jj]
+    order = np.argsort(scores)[::-1]
+
+    similar_pairs = [
+        _pair_record(i, j, score, face_ids, src_names, regions)
+        for i, j, score in zip(ii[order], jj[order], scores[order])
+    ]
+
+    print(f"✅ Found {len(similar_pairs)} similar face pair(s) above threshold {threshold}")
+    return similar_pairs
+
+# Fused tiled sweep for large galleries: compute (B, B) blocks of
+# emb @ emb.T and filter by threshold immediately, so the full N x N
+# matrix is never materialized. B=512 keeps each fp32 block around 1 MB
+# (L2-resident) and halves DRAM traffic versus a matrix-then-filter pass.
+TILE_SIZE = 512
+
+def find_similar_faces_tiled(face_data, face_ids, src_names, src_ids, regions,
+                             threshold=SIMILARITY_THRESHOLD, block=TILE_SIZE):
+    n = len(face_ids)
+    emb = np.stack([face_data[fid]['embedding'] for fid in face_ids]).astype(np.float32, copy=False)
+    if not np.allclose(np.linalg.norm(emb[0]), 1.0):
+        emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+
+    def _sweep_row(i0):
+        rows = emb[i0:i0 + block]
+        pairs = []
+        for j0 in range(i0, n, block):
+            blk = rows @ emb[j0:j0 + block].T
+            ri, rj = np.nonzero(blk >= threshold)
+            scores = blk[ri, rj]
+            ii, jj = ri + i0, rj + j0
+            keep = (jj > ii) & (src_ids[ii] != src_ids[jj])
+            pairs.extend(
+                _pair_record(i, j, score, face_ids, src_names, regions)
+                for i, j, score in zip(ii[keep], jj[keep], scores[keep])
+            )
+        return pairs
+
+    # The block GEMMs release the GIL, so threads scale across cores
+    # without the pickling cost of a process pool.
+    results = Parallel(n_jobs=-1, backend='threading')(
+        delayed(_sweep_row)(i0) for i0 in range(0, n, block)
+    )
+    similar_pairs = [pair for pairs in results for pair in pairs]
+    similar_pairs.sort(key=lambda p: p['similarity'], reverse=True)
+    print(f"✅ Found {len(similar_pairs)} similar face pair(s) above threshold {threshold}")
+    return similar_pairs
+
+# HNSW pair finding: instead of O(N^2) time and memory, query the top-k
+# neighbors of every face from an HNSW graph and keep those above the
+# threshold. Memory is O(N * M) and the matrix is never built at all.
+def find_similar_faces_hnsw(face_data, face_ids, src_names, src_ids, regions,
+                            threshold=SIMILARITY_THRESHOLD, k=50):
+    n = len(face_ids)
+    emb = np.stack([face_data[fid]['embedding'] for fid in face_ids]).astype(np.float32, copy=False)
+    if not np.allclose(np.linalg.norm(emb[0]), 1.0):
+        emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+    emb = np.ascontiguousarray(emb)
+
+    index = faiss.IndexHNSWFlat(512, 32, faiss.METRIC_INNER_PRODUCT)
+    index.add(emb)
+    D, I = index.search(emb, min(k, n))
+
+    rows = np.repeat(np.arange(n), D.shape[1])
+    cols = I.ravel()
+    sims = D.ravel()
+    # j > i dedupes each pair (and drops self-matches); -1 marks
+    # unfilled neighbor slots
+    keep = (cols > rows) & (sims >= threshold) & (src_ids[rows] != src_ids[np.clip(cols, 0, n - 1)])
+    # Re-score the (few) survivors exactly rather than trusting the
+    # graph-reported distances
+    similar_pairs = [
+        _pair_record(i, j, cos_sim_unit(emb[i], emb[j]), face_ids, src_names, regions)
+        for i, j in zip(rows[keep], cols[keep])
+    ]
+    similar_pairs.sort(key=lambda p: p['similarity'], reverse=True)
+    print(f"✅ Found {len(similar_pairs)} similar face pair(s) above threshold {threshold} (HNSW, k={k})")
+    return similar_pairs
+
+# Summarize same-image vs cross-image similarity scores
+def analyze_similarity_distribution(src_ids, similarity_matrix):
+    n = len(src_ids)
+    iu = np.triu_indices(n, k=1)
+    same_src = src_ids[iu[0]] == src_ids[iu[1]]
+    scores = similarity_matrix[iu]
+
+    same_image_scores = scores[same_src]
+    cross_image_scores = scores[~same_src]
+
+    for label, arr in [("same-image", same_image_scores), ("cross-image", cross_image_scores)]:
+        if arr.size:
+            print(f"📊 {label}: n={arr.size} mean={arr.mean():.4f} min={arr.min():.4f} max={arr.max():.4f}")
+        else:
+            print(f"📊 {label}: no pairs")
+
+    return same_image_scores, cross_image_scores
+
+# Decode a source image once; the visualization phase hits the same
+# handful of files over and over.
+@functools.lru_cache(maxsize=64)
+def _load_rgb(image_path):
+    img = cv2.imread(image_path)
+    if img is None:
+        return None
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+@functools.lru_cache(maxsize=256)
+def _extract_face_cached(image_path, x, y, w, h):
+    img = _load_rgb(image_path)
+    if img is None:
+        return None
+    return img[y:y + h, x:x + w]
+
+# Crop a face region out of its source image
+def extract_face_from_image(image_path, region):
+    return _extract_face_cached(image_path, region['x'], region['y'], region['w'], region['h'])
+
+# Save side-by-side visualizations for the top similar pairs
+def create_comparison_visualizations(similar_pairs, image_dir=IMAGE_DIR, output_dir=OUTPUT_DIR, max_pairs=20):
+    os.makedirs(output_dir, exist_ok=True)
+    pairs = similar_pairs[:max_pairs]
+
+    # Decode each unique source image once up front; the pair loop and
+    # the grid below then reuse the cached arrays.
+    for source in {p[key] for p in pairs for key in ('face1_source', 'face2_source')}:
+        _load_rgb(os.path.join(image_dir, source))
+
+    # One Figure reused across pairs — allocating and tearing down a
+    # figure per savefig costs ~50 ms each.
+    fig = plt.figure(figsize=(15, 10))
+
+    for idx, pair in enumerate(tqdm(pairs, desc="Creating visualizations")):
+        path1 = os.path.join(image_dir, pair['face1_source'])
+        path2 = os.path.join(image_dir, pair['face2_source'])
+
+        img1 = _load_rgb(path1)
+        img2 = _load_rgb(path2)
+        if img1 is None or img2 is None:
+            print(f"⚠️ Missing source image for pair {idx + 1}")
+            continue
+
+        face1 = extract_face_from_image(path1, pair['face1_region'])
+        face2 = extract_face_from_image(path2, pair['face2_region'])
+        if face1 is None or face2 is None:
+            continue
+
+        fig.clear()
+        for pos, (image, title) in enumerate([
+            (img1, pair['face1_source']),
+            (img2, pair['face2_source']),
+            (face1, pair['face1_id']),
+            (face2, pair['face2_id'])
+        ]):
+            ax = fig.add_subplot(2, 2, pos + 1)
+            ax.imshow(image)
+            ax.set_title(title, fontsize=9)
+            ax.axis('off')
+
+        fig.suptitle(f"Similarity: {pair['similarity']:.4f}")
+        fig.savefig(os.path.join(output_dir, f"pair_{idx + 1:03d}.jpg"))
+
+    # Grid overview of the matched face crops (same pooled figure)
+    if pairs:
+        cols = 4
+        rows = (len(pairs) + cols - 1) // cols
+        fig.clear()
+        fig.set_size_inches(4 * cols, 4 * rows)
+        for idx, pair in enumerate(pairs):
+            face1 = extract_face_from_image(os.path.join(image_dir, pair['face1_source']), pair['face1_region'])
+            if face1 is None:
+                continue
+            ax = fig.add_subplot(rows, cols, idx + 1)
+            ax.imshow(face1)
+            ax.set_title(f"{pair['similarity']:.3f}", fontsize=8)
+            ax.axis('off')
+        fig.savefig(os.path.join(output_dir, "pairs_grid.jpg"))
+
+    plt.close(fig)
+    print(f"✅ Visualizations saved to '{output_dir}'")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embeddings-dir", default=EMBEDDINGS_DIR, help="Directory with per-face .pkl embeddings")
+    parser.add_argument("--image-dir", default=IMAGE_DIR, help="Directory with source images")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Directory for comparison visualizations")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD, help="Cosine similarity threshold")
+    parser.add_argument("--max-pairs", type=int, default=20, help="Max pairs to visualize")
+    parser.add_argument("--int8", action="store_true", help="Quantize embeddings to int8 for the similarity sweep")
+    parser.add_argument("--tiled", action="store_true", help="Tile the similarity sweep instead of materializing the full matrix")
+    parser.add_argument("--faiss", action="store_true", help="Find pairs with an approximate HNSW index (requires faiss)")
+    args = parser.parse_args()
+
+    face_data = load_face_embeddings(args.embeddings_dir)
+    if not face_data:
+        print("❌ No embeddings found.")
+        return
+
+    face_ids, src_names, src_ids, regions = build_face_arrays(face_data)
+
+    # The full N x N matrix costs N^2 * 4 bytes; beyond ~20k faces the
+    # HNSW index (O(N log N)) or the tiled sweep keeps memory flat
+    # (distribution stats are skipped in both).
+    if args.faiss or (len(face_data) >= 20000 and HAS_FAISS and not args.tiled):
+        if not HAS_FAISS:
+            print("❌ --faiss requested but faiss is not installed.")
+            return
+        similar_pairs = find_similar_faces_hnsw(face_data, face_ids, src_names, src_ids, regions,
+                                                threshold=args.threshold)
+    elif args.tiled or len(face_data) >= 20000:
+        similar_pairs = find_similar_faces_tiled(face_data, face_ids, src_names, src_ids, regions,
+                                                 threshold=args.threshold)
+    else:
+        similarity_matrix = compute_similarity_matrix(face_data, face_ids, use_int8=args.int8)
+        analyze_similarity_distribution(src_ids, similarity_matrix)
+        similar_pairs = find_similar_faces(face_ids, src_names, src_ids, regions,
+                                           similarity_matrix, threshold=args.threshold)
+    create_comparison_visualizations(similar_pairs, image_dir=args.image_dir,
+                                     output_dir=args.output_dir, max_pairs=args.max_pairs)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+import os
+import argparse
+import heapq
+import pickle
+import numpy as np
+import cv2
+from tqdm import tqdm
+
+# libjpeg-turbo decodes straight to RGB 2-4x faster than OpenCV's
+# default backend; fall back to cv2 when it is not installed.
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    tj = TurboJPEG()
+except Exception:
+    tj = None
+
+# simsimd ships hand-written dot-product kernels (4-accumulator FMA
+# loops) and picks AVX-512F / AVX2+FMA / NEON at import time based on
+# the running CPU — same dispatch as compare_embeddings.py.
+try:
+    import simsimd as simd
+    HAS_SIMSIMD = True
+except ImportError:
+    HAS_SIMSIMD = False
+
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+try:
+    import faiss
+    HAS_FAISS = True
+except ImportError:
+    HAS_FAISS = False
+
+# Configs
+EMBEDDINGS_FILE = os.getenv("EMBEDDINGS_FILE", "face_embeddings.pkl")
+IMAGE_DIR = os.getenv("IMAGE_DIR", "test_images")
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "pair_comparisons")
+
+# Load the SoA embeddings pickle written by generate_embeddings.py:
+# (ids, owners, regions recarray, emb_matrix) parallel arrays.
+def load_embeddings(embeddings_file):
+    with open(embeddings_file, 'rb') as f:
+        ids, owners, regions, emb_matrix = pickle.load(f)
+    print(f"🔍 Loaded {len(np.unique(owners))} image(s) with {len(ids)} face(s) from '{embeddings_file}'")
+    return ids, owners, regions, emb_matrix
+
+# Decode an image to RGB; callers decode each unique file exactly once
+# and pass the arrays around, so no caching is needed here.
+def _decode_rgb(image_path):
+    if tj is not None:
+        try:
+            with open(image_path, 'rb') as f:
+                return tj.decode(f.read(), pixel_format=TJPF_RGB)
+        except Exception:
+            pass  # not a JPEG — let OpenCV try
+    img = cv2.imread(image_path)
+    if img is None:
+        return None
+    # Reversed-stride view instead of cvtColor: downstream only reads
+    # pixels (crop / copy+draw), so skip the full-frame memcpy.
+    return img[:, :, ::-1]
+
+# Crop a face region out of an already-decoded image
+def extract_face(img, region):
+    x, y, w, h = region['x'], region['y'], region['w'], region['h']
+    return img[y:y + h, x:x + w]
+
+# Return a copy of the image with the face region outlined. The copy is
+# per call, not per decode: the same decoded array is highlighted with
+# different regions across pairs.
+def get_image_with_face_highlighted(img, region):
+    img = img.copy()
+    x, y, w, h = region['x'], region['y'], region['w'], region['h']
+    cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 3)
+    return img
+
+# Resize to a target height, keeping aspect ratio. cv2 rejects
+# negative-stride views, so make crops contiguous here (no-op for
+# already-contiguous input).
+def _resize_h(img, h):
+    img = np.ascontiguousarray(img)
+    return cv2.resize(img, (max(1, int(img.shape[1] * h / img.shape[0])), h))
+
+# Pad an image on the right to the given width
+def _pad_w(img, w):
+    if img.shape[1] >= w:
+        return img
+    pad = np.zeros((img.shape[0], w - img.shape[1], 3), dtype=img.dtype)
+    return np.hstack([img, pad])
+
+if HAS_NUMBA:
+    # Cache-blocked N² kernel: 64x64 tiles keep each tile's working set
+    # (~64 KB of f32 512-D rows) inside L2, prange parallelizes the
+    # outer tile rows, and LLVM auto-vectorizes the inner dot into FMAs.
+    # Below the BLAS crossover (roughly N*D < 128k) this beats sgemm's
+    # dispatch + packing overhead.
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _pairwise_cos_numba(E):
+        N, D = E.shape
+        out = np.empty((N, N), np.float32)
+        BLOCK = 64
+        for ii in prange(0, N, BLOCK):
+            for jj in range(0, N, BLOCK):
+                for i in range(ii, min(ii + BLOCK, N)):
+                    for j in range(jj, min(jj + BLOCK, N)):
+                        s = np.float32(0.0)
+                        for k in range(D):
+                            s += E[i, k] * E[j, k]
+                        out[i, j] = s
+        return out
+
+# All-pairs cosine on unit-norm rows: simsimd's runtime-dispatched SIMD
+# dot kernel when available, the numba-tiled kernel for matrices below
+# the BLAS crossover, sgemm otherwise.
+def cosine_similarity_batch(embs):
+    if HAS_SIMSIMD:
+        return (1.0 - np.asarray(simd.cdist(embs, embs, metric='cosine'))).astype(np.float32)
+    if HAS_NUMBA and embs.shape[0] * embs.shape[1] < 128_000:
+        return _pairwise_cos_numba(np.ascontiguousarray(embs))
+    return embs @ embs.T
+
+# Large-corpus selection: FAISS IndexFlatIP returns top-k inner
+# products in one BLAS call + partial sort, so the N^2 score matrix is
+# never materialized. Lowest pairs come from querying with negated
+# vectors; middle pairs are picked from a random cross-image sample
+# around its median (exactness doesn't matter for a visual spot check).
+def _select_pairs_faiss(embs, owner_ids, k):
+    idx = faiss.IndexFlatIP(embs.shape[1])
+    idx.add(embs)
+
+    def best(query, sign):
+        # extra slots soak up self-hits and same-image neighbours
+        D, I = idx.search(query, min(8, embs.shape[0]))
+        cands = {}
+        for i in range(I.shape[0]):
+            for d, j in zip(D[i], I[i]):
+                j = int(j)
+                if j == i or owner_ids[i] == owner_ids[j]:
+                    continue
+                a, b = (i, j) if i < j else (j, i)
+                cands[(a, b)] = sign * float(d)
+        ranked = sorted(cands.items(), key=lambda kv: -kv[1])
+        return [(a, b, s) for (a, b), s in ranked[:k]]
+
+    top = best(embs, 1.0)
+    bot = [(a, b, -s) for a, b, s in best(-embs, 1.0)]
+
+    mid = _middle_sample(embs, owner_ids, k)
+
+    return (
+        [("highest", i, j, s) for i, j, s in top]
+        + [("middle", i, j, s) for i, j, s in mid]
+        + [("lowest", i, j, s) for i, j, s in bot]
+    )
+
+# Middle pairs from a random cross-image sample scored around its
+# median — exactness doesn't matter for a visual spot check.
+def _middle_sample(embs, owner_ids, k):
+    rng = np.random.default_rng(0)
+    si = rng.integers(0, embs.shape[0], 100_000)
+    sj = rng.integers(0, embs.shape[0], 100_000)
+    keep = (si != sj) & (owner_ids[si] != owner_ids[sj])
+    si, sj = si[keep], sj[keep]
+    s_scores = np.einsum('ij,ij->i', embs[si], embs[sj])
+    near_med = np.argpartition(np.abs(s_scores - np.median(s_scores)), k - 1)[:k]
+    return [(int(si[m]), int(sj[m]), float(s_scores[m])) for m in near_med]
+
+# No-faiss large-corpus selection: tile the matmul in CHUNK-row blocks
+# so each tile's operands stay cache-resident and the n^2 score matrix
+# is never materialized — peak extra memory is one CHUNK^2 tile. Running
+# heaps carry the global top-k / bottom-k across tiles.
+CHUNK = 256
+
+def _select_pairs_chunked(embs, owner_ids, k):
+    n = embs.shape[0]
+    top, bot = [], []  # min-heaps of (score, i, j) / (-score, i, j)
+
+    for a in range(0, n, CHUNK):
+        gi = np.arange(a, min(a + CHUNK, n))
+        A = embs[gi]
+        for b in range(a, n, CHUNK):
+            gj = np.arange(b, min(b + CHUNK, n))
+            S = A @ embs[gj].T
+
+            valid = owner_ids[gi][:, None] != owner_ids[gj][None, :]
+            if a == b:
+                valid &= gi[:, None] < gj[None, :]
+            vs = S[valid]
+            if vs.size == 0:
+                continue
+            vi, vj = np.nonzero(valid)
+
+            kk = min(k, vs.size)
+            for m in np.argpartition(-vs, kk - 1)[:kk]:
+                item = (float(vs[m]), int(gi[vi[m]]), int(gj[vj[m]]))
+                if len(top) < k:
+                    heapq.heappush(top, item)
+                elif item > top[0]:
+                    heapq.heapreplace(top, item)
+            for m in np.argpartition(vs, kk - 1)[:kk]:
+                item = (-float(vs[m]), int(gi[vi[m]]), int(gj[vj[m]]))
+                if len(bot) < k:
+                    heapq.heappush(bot, item)
+                elif item > bot[0]:
+                    heapq.heapreplace(bot, item)
+
+    mid = _middle_sample(embs, owner_ids, k)
+
+    return (
+        [("highest", i, j, s) for s, i, j in sorted(top, reverse=True)]
+        + [("middle", i, j, s) for i, j, s in mid]
+        + [("lowest", i, j, -s) for s, i, j in sorted(bot, reverse=True)]
+    )
+
+# Save an RGB canvas as JPEG
+def _imwrite_rgb(path, canvas):
+    cv2.imwrite(path, cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+# Pick the 3 highest / 3 middle / 3 lowest similarity cross-image face
+# pairs and save a comparison panel for each, plus a 3x3 overview grid.
+def compare_random_image_pairs(data, input_dir=IMAGE_DIR, output_dir=OUTPUT_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+
+    ids, owner_img, regions, emb_matrix = data
+    if len(np.unique(owner_img)) < 2:
+        print("❌ Need faces from at least two images to compare.")
+        return
+
+    # The store is already SoA: one contiguous matrix plus parallel
+    # metadata arrays. Upcast fp16 storage to f32 once for the BLAS /
+    # SIMD kernels; per-image face numbers come from the id suffix.
+    embs = np.ascontiguousarray(emb_matrix, dtype=np.float32)
+    face_idx = np.array([int(str(fid).rsplit('_', 1)[1]) - 1 for fid in ids])
+    # Embeddings are stored pre-normalized; only re-normalize if an
+    # older pickle without unit-norm vectors is loaded.
+    if not np.allclose(np.linalg.norm(embs[0]), 1.0, atol=1e-3):
+        embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+
+    n = embs.shape[0]
+    owner_ids = np.unique(owner_img, return_inverse=True)[1]
+
+    if n >= 10_000:
+        # Past ~10k faces the dense matrix costs n^2 floats; reduce
+        # tile by tile instead of building it.
+        if HAS_FAISS:
+            selected = _select_pairs_faiss(embs, owner_ids, k=3)
+        else:
+            selected = _select_pairs_chunked(embs, owner_ids, k=3)
+    else:
+        S = cosine_similarity_batch(embs)
+
+        iu_i, iu_j = np.triu_indices(n, k=1)
+        cross = owner_ids[iu_i] != owner_ids[iu_j]
+        pi, pj = iu_i[cross], iu_j[cross]
+        scores = S[pi, pj]
+        if scores.size == 0:
+            print("❌ No cross-image face pairs found.")
+            return
+
+        # Partial selection throughout: top/bottom 3 via argpartition,
+        # middle 3 as the scores closest to the median — np.median is
+        # itself a selection, so no O(n log n) sort anywhere.
+        k = min(3, scores.size)
+        top_idx = np.argpartition(-scores, k - 1)[:k]
+        top_idx = top_idx[np.argsort(-scores[top_idx])]
+        bot_idx = np.argpartition(scores, k - 1)[:k]
+        bot_idx = bot_idx[np.argsort(scores[bot_idx])]
+        mid_idx = np.argpartition(np.abs(scores - np.median(scores)), k - 1)[:k]
+
+        selected = (
+            [("highest", int(pi[p]), int(pj[p]), float(scores[p])) for p in top_idx]
+            + [("middle", int(pi[p]), int(pj[p]), float(scores[p])) for p in mid_idx]
+            + [("lowest", int(pi[p]), int(pj[p]), float(scores[p])) for p in bot_idx]
+        )
+
+    if not selected:
+        print("❌ No cross-image face pairs found.")
+        return
+
+    # Decode each referenced image exactly once — the selected pairs
+    # reference far fewer unique files than pair-loop iterations, and
+    # every extra imread/cvtColor is a full libjpeg pass.
+    needed = {str(owner_img[i]) for _, i, j, _s in selected} | {str(owner_img[j]) for _, i, j, _s in selected}
+    decoded = {name: _decode_rgb(os.path.join(input_dir, name)) for name in needed}
+
+    grid_cells = []
+    for rank, (label, i, j, similarity) in enumerate(tqdm(selected, desc="Comparing pairs")):
+        img1, img2 = str(owner_img[i]), str(owner_img[j])
+        face1_idx, face2_idx = int(face_idx[i]), int(face_idx[j])
+
+        if decoded[img1] is None or decoded[img2] is None:
+            print(f"⚠️ Missing source image for pair {rank + 1}")
+            continue
+
+        region1 = regions[i]
+        region2 = regions[j]
+
+        img1_with_face = get_image_with_face_highlighted(decoded[img1], region1)
+        img2_with_face = get_image_with_face_highlighted(decoded[img2], region2)
+        face1 = extract_face(decoded[img1], region1)
+        face2 = extract_face(decoded[img2], region2)
+
+        # Compose the 2x2 panel as one NumPy canvas and write it with
+        # cv2.imwrite — matplotlib's figure/axes machinery costs
+        # hundreds of ms per savefig and does nothing useful here.
+        i1 = _resize_h(img1_with_face, 600)
+        i2 = _resize_h(img2_with_face, 600)
+        cv2.putText(i1, f"{img1} Face {face1_idx + 1}", (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 1)
+        cv2.putText(i2, f"{img2} Face {face2_idx + 1}", (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 1)
+        top = np.hstack([i1, i2])
+
+        f1 = _resize_h(face1, 300)
+        f2 = _resize_h(face2, 300)
+        bottom = _pad_w(np.hstack([f1, f2]), top.shape[1])
+        top = _pad_w(top, bottom.shape[1])
+        canvas = np.vstack([top, bottom])
+        cv2.putText(canvas, f"[{label}] Similarity: {similarity:.4f}", (10, canvas.shape[0] - 12),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+        _imwrite_rgb(os.path.join(output_dir, f"pair_{rank + 1:02d}_{label}.jpg"), canvas)
+
+        grid_cells.append((face1, face2, similarity, label))
+
+    # 3x3 overview grid of the selected pairs: fixed-size cells stacked
+    # with hstack/vstack, one imwrite total.
+    if grid_cells:
+        CELL_H, CELL_W = 180, 360
+        cells = []
+        for face1, face2, similarity, label in grid_cells[:9]:
+            cell = np.zeros((CELL_H, CELL_W, 3), dtype=np.uint8)
+            f1 = _resize_h(face1, 150)[:, :CELL_W // 2]
+            f2 = _resize_h(face2, 150)[:, :CELL_W // 2]
+            cell[:150, :f1.shape[1]] = f1
+            cell[:150, CELL_W // 2:CELL_W // 2 + f2.shape[1]] = f2
+            cv2.putText(cell, f"{label}: {similarity:.3f}", (10, CELL_H - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
+            cells.append(cell)
+        while len(cells) % 3:
+            cells.append(np.zeros((CELL_H, CELL_W, 3), dtype=np.uint8))
+        grid = np.vstack([np.hstack(cells[r:r + 3]) for r in range(0, len(cells), 3)])
+        _imwrite_rgb(os.path.join(output_dir, "pairs_grid.jpg"), grid)
+
+    print(f"✅ Pair comparisons saved to '{output_dir}'")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embeddings-file", default=EMBEDDINGS_FILE, help="Combined embeddings pickle")
+    parser.add_argument("--input-dir", default=IMAGE_DIR, help="Directory with source images")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Directory for comparison output")
+    args = parser.parse_args()
+
+    data = load_embeddings(args.embeddings_file)
+    compare_random_image_pairs(data, input_dir=args.input_dir, output_dir=args.output_dir)
+
+if __name__ == "__main__":
+    main()
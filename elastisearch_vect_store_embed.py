@@ -0,0 +1,172 @@
+import os
+import argparse
+import asyncio
+import io
+import torch
+import numpy as np
+from pathlib import Path
+from PIL import Image
+from tqdm import tqdm
+from multiprocessing import get_context
+from dotenv import load_dotenv
+from elasticsearch import Elasticsearch, helpers
+from facenet_pytorch import MTCNN, InceptionResnetV1
+
+# Async file IO (optional): a worker's eight image reads go out
+# together instead of one blocking open+read at a time.
+try:
+    import aiofiles
+    HAS_AIOFILES = True
+except ImportError:
+    HAS_AIOFILES = False
+
+# Load .env
+load_dotenv()
+
+# Configs
+ES_HOST = os.getenv("ES_HOST", "http://localhost:9200")
+INDEX_NAME = os.getenv("INDEX_NAME", "face_embeddings")
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "8"))
+NUM_WORKERS = max(1, (os.cpu_count() or 8) // 2)
+
+# This pipeline fans out over a fork pool, and forked children cannot
+# re-initialize CUDA once the parent has touched it — so the models
+# stay pinned to the CPU like deepseek_embed_logic.py; the
+# single-process GPU path lives in pinecone_s3_embeds.py.
+
+# Per-worker globals, bound in init_worker. The models come from the
+# parent via fork + shared memory — one copy of the weights for the
+# whole pool; only the ES client is per-worker (it holds sockets).
+mtcnn = None
+resnet = None
+es = None
+
+def init_worker(shared_mtcnn, shared_resnet):
+    global mtcnn, resnet, es
+    torch.set_num_threads(1)
+    mtcnn = shared_mtcnn
+    resnet = shared_resnet
+    es = Elasticsearch(ES_HOST, verify_certs=False)
+
+# Create index if not exists
+def create_index(client):
+    if client.indices.exists(index=INDEX_NAME):
+        print(f"✅ Index '{INDEX_NAME}' already exists.")
+        return
+
+    print(f"🚀 Creating index '{INDEX_NAME}' with vector search enabled...")
+    client.indices.create(
+        index=INDEX_NAME,
+        body={
+            "settings": {
+                "number_of_shards": 1,
+                "number_of_replicas": 0
+            },
+            "mappings": {
+                "properties": {
+                    "image_name": {"type": "keyword"},
+                    "embeds": {
+                        "type": "dense_vector",
+                        "dims": 512,
+                        "index": True,
+                        "similarity": "dot_product",
+                        "element_type": "float"
+                    },
+                    "box": {
+                        "type": "dense_vector",
+                        "dims": 4
+                    }
+                }
+            }
+        }
+    )
+
+async def _read_all(paths):
+    async def _read(p):
+        async with aiofiles.open(p, 'rb') as f:
+            return await f.read()
+    return await asyncio.gather(*[_read(p) for p in paths])
+
+# Fetch the batch's file bytes with every read in flight at once;
+# decoding still happens lazily inside Image.open. Degrades to PIL
+# opening the paths directly when aiofiles is absent.
+def _read_batch(batch_files):
+    if not HAS_AIOFILES:
+        return batch_files
+    datas = asyncio.run(_read_all([path for _, path in batch_files]))
+    return [(name, io.BytesIO(data)) for (name, _), data in zip(batch_files, datas)]
+
+# Embed every face in a batch of images and bulk-index the whole batch
+# in one Elasticsearch request instead of one es.index call per face
+def process_batch(batch_files):
+    actions = []
+
+    for image_file, src in _read_batch(batch_files):
+        try:
+            img = Image.open(src).convert('RGB')
+
+            boxes, probs = mtcnn.detect(img)
+            if boxes is None:
+                continue
+
+            crops = mtcnn.extract(img, boxes, save_path=None)
+            if crops is None:
+                continue
+            if crops.dim() == 3:
+                crops = crops.unsqueeze(0)
+
+            with torch.no_grad():
+                embeddings = resnet(crops).cpu().numpy()
+
+            for i, (emb, box) in enumerate(zip(embeddings, boxes)):
+                emb = emb / np.linalg.norm(emb)
+                face_id = f"{Path(image_file).stem}_face_{i+1}"
+                actions.append({
+                    "_op_type": "index",
+                    "_index": INDEX_NAME,
+                    "_id": face_id,
+                    "_source": {
+                        "image_name": image_file,
+                        "embeds": emb.tolist(),
+                        "box": [float(v) for v in box]
+                    }
+                })
+        except Exception as e:
+            print(f"⚠️ Error processing {image_file}: {e}")
+
+    if actions:
+        helpers.bulk(es, actions, chunk_size=500, request_timeout=60)
+    return len(actions)
+
+def process_images(input_dir):
+    # scandir hands back DirEntry objects with the joined path and a
+    # cached stat — no extra syscall or string join per file.
+    with os.scandir(input_dir) as it:
+        files = [(e.name, e.path) for e in it
+                 if e.is_file(follow_symlinks=False) and e.name.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    print(f"🔍 Found {len(files)} image(s) in '{input_dir}'")
+
+    parent_mtcnn = MTCNN(image_size=160, margin=20, keep_all=True, device='cpu')
+    parent_resnet = InceptionResnetV1(pretrained='vggface2').eval()
+    parent_resnet.share_memory()
+
+    batches = [files[i:i + BATCH_SIZE] for i in range(0, len(files), BATCH_SIZE)]
+    total = 0
+    ctx = get_context('fork')
+    with ctx.Pool(NUM_WORKERS, initializer=init_worker,
+                  initargs=(parent_mtcnn, parent_resnet)) as pool:
+        for count in tqdm(pool.imap_unordered(process_batch, batches), total=len(batches)):
+            total += count
+
+    print(f"✅ Indexed {total} face(s) into '{INDEX_NAME}'")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input-dir", default="test_images", help="Path to image folder")
+    args = parser.parse_args()
+
+    create_index(Elasticsearch(ES_HOST, verify_certs=False))
+    process_images(args.input_dir)
+
+if __name__ == "__main__":
+    main()
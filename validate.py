@@ -13,22 +13,22 @@ IMAGE_DIR = os.getenv("IMAGE_DIR", "test_images")  # Path to local images
 # Connect to Elasticsearch
 es = Elasticsearch(ES_HOST, verify_certs=False)
 
-# Generate a random 512-dim embedding vector as query (replace with real embed if needed)
-query_vector = np.random.rand(512).tolist()
-
-# Build search query
+# Generate a random unit-norm 512-dim embedding as query (the index
+# stores unit vectors for dot_product similarity; replace with a real
+# embed if needed)
+query_vector = np.random.rand(512).astype(np.float32)
+query_vector = (query_vector / np.linalg.norm(query_vector)).tolist()
+
+# kNN search walks the HNSW graph on the dense_vector field — sub-linear
+# in index size, unlike the old script_score scan that re-scored every
+# document with cosineSimilarity
 query = {
     "size": 1,
-    "query": {
-        "script_score": {
-            "query": { "match_all": {} },
-            "script": {
-                "source": "cosineSimilarity(params.query_vector, 'embeds') + 1.0",
-                "params": {
-                    "query_vector": query_vector
-                }
-            }
-        }
+    "knn": {
+        "field": "embeds",
+        "query_vector": query_vector,
+        "k": 1,
+        "num_candidates": 50
     }
 }
 
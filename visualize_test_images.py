@@ -0,0 +1,84 @@
+import os
+import argparse
+import json
+import numpy as np
+import cv2
+from tqdm import tqdm
+
+# Configs
+IMAGE_DIR = os.getenv("IMAGE_DIR", "test_images")
+EMBED_DIR = os.getenv("EMBED_DIR", "embeds/faces")
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "visualizations")
+
+# Montage layout
+GRID_ROWS, GRID_COLS = 4, 4
+TH, TW = 240, 320
+
+# Read the memmap shard + JSONL sidecar written by
+# s3_fetch_embedding_local.py
+def load_embeddings(embed_dir):
+    meta_path = os.path.join(embed_dir, "metadata.jsonl")
+    shard_path = os.path.join(embed_dir, "embeddings.f32")
+    with open(meta_path) as f:
+        meta = [json.loads(line) for line in f]
+    embs = None
+    if os.path.exists(shard_path):
+        embs = np.memmap(shard_path, dtype=np.float32, mode='r').reshape(-1, 512)
+    print(f"🔍 Loaded {len(meta)} face record(s) from '{meta_path}'")
+    return meta, embs
+
+def faces_by_image(meta):
+    groups = {}
+    for m in meta:
+        groups.setdefault(m['source_image'], []).append(m)
+    return groups
+
+# Draw every detected face region onto its source image and save the
+# annotated frame with one cv2.imwrite — no matplotlib figure spin-up
+# per image. The annotated arrays are kept for the montage so nothing
+# is decoded or drawn twice.
+def visualize_test_images(input_dir, embed_dir, output_dir):
+    meta, _ = load_embeddings(embed_dir)
+    groups = faces_by_image(meta)
+    os.makedirs(output_dir, exist_ok=True)
+
+    annotated = {}
+    for image_file, faces in tqdm(groups.items(), desc="Annotating"):
+        img = cv2.imread(os.path.join(input_dir, image_file))
+        if img is None:
+            print(f"⚠️ Could not read image: {image_file}")
+            continue
+        for j, m in enumerate(faces):
+            r = m['region']
+            cv2.rectangle(img, (r['x'], r['y']), (r['x'] + r['w'], r['y'] + r['h']), (0, 255, 0), 2)
+            cv2.putText(img, f"face {j + 1}", (r['x'], max(12, r['y'] - 6)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+        cv2.imwrite(os.path.join(output_dir, f"faces_{image_file}"), img)
+        annotated[image_file] = img
+
+    create_face_montage(annotated, output_dir)
+    print(f"✅ Wrote {len(annotated)} annotated image(s) to '{output_dir}'")
+
+# Stamp pre-resized thumbnails into one preallocated canvas and write
+# the montage once
+def create_face_montage(annotated, output_dir):
+    files = list(annotated)[:GRID_ROWS * GRID_COLS]
+    if not files:
+        return
+    canvas = np.zeros((GRID_ROWS * TH, GRID_COLS * TW, 3), np.uint8)
+    for idx, image_file in enumerate(files):
+        r, c = divmod(idx, GRID_COLS)
+        canvas[r * TH:(r + 1) * TH, c * TW:(c + 1) * TW] = cv2.resize(annotated[image_file], (TW, TH))
+    cv2.imwrite(os.path.join(output_dir, "montage.jpg"), canvas)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input-dir", default=IMAGE_DIR, help="Directory with source images")
+    parser.add_argument("--embed-dir", default=EMBED_DIR, help="Directory with the embedding shard")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Directory for annotated output")
+    args = parser.parse_args()
+
+    visualize_test_images(args.input_dir, args.embed_dir, args.output_dir)
+
+if __name__ == "__main__":
+    main()